@@ -0,0 +1,189 @@
+"""End to end performance harness. Runs `python -m terraform_ci` the way `action.yml` does, with the
+config passed through `CONFIG__*` environment variables, against stub `terraform`, `tfswitch` and
+`checkov` binaries (see `e2e/bin`) and a local stand-in for the GitHub releases API, so no network
+or credentials are needed.
+
+Each mode runs as its own process. Reports wall time, peak RSS of the largest single process (the
+entry point or one of its stubs, not a sum over the tree), plan retries and the time spent in each
+step (from `TERRAFORM_CI_TIMINGS`). `startup` is everything outside the steps: interpreter start,
+imports, settings parsing, `tfswitch` and writing the credentials.
+
+    python e2e/harness.py --resources 5000 --checks 50000 --latency 0.1
+    python e2e/harness.py --rate-limit 2
+    python e2e/harness.py --output baseline.json
+    python e2e/harness.py --baseline baseline.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import shutil
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+STUB_BIN = os.path.join(HERE, "bin")
+
+
+class ReleasesHandler(BaseHTTPRequestHandler):
+    """Accepts release posts like the GitHub API does."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"id": 1}).encode()
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        pass
+
+
+def action_env(mode: str, work_dir: str, args: argparse.Namespace) -> dict[str, str]:
+    """Environment `action.yml` hands to the container, unset inputs are empty strings."""
+    return {
+        "CONFIG__TERRAFORM__VERSION": "",
+        "CONFIG__TERRAFORM__HOST": "",
+        "CONFIG__TERRAFORM__TOKEN": "stub",
+        "CONFIG__TERRAFORM__INIT_MODE": "",
+        "CONFIG__TERRAFORM__PARALLELISM": args.parallelism,
+        "CONFIG__RESOURCE__REPLACE": "",
+        "CONFIG__RESOURCE__IMPORTS": "",
+        "CONFIG__WORKING_DIRECTORY": work_dir,
+        "CONFIG__MODE": mode,
+        "CONFIG__GITHUB__TOKEN": "stub",
+        "CONFIG__CREATE_RELEASE": "true" if mode == "apply" else "",
+        "CONFIG__DRIFT__ROOTS": "",
+        "YAML_CONFIG": "",
+    }
+
+
+def run_mode(mode: str, args: argparse.Namespace, api_url: str) -> dict:
+    """Runs the entry point for a mode with the stubs first on the PATH."""
+    work_dir = tempfile.mkdtemp(prefix="terraform-ci-e2e-")
+    temp_dir = os.path.join(work_dir, "app")
+    os.makedirs(temp_dir)
+    timings = os.path.join(work_dir, "timings.json")
+    log_file = os.path.join(work_dir, "pipeline.log")
+
+    env = {
+        **os.environ,
+        **action_env(mode, work_dir, args),
+        "PATH": STUB_BIN + os.pathsep + os.environ.get("PATH", ""),
+        "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "HOME": work_dir,
+        "TERRAFORM_CI_TEMP_DIR": temp_dir,
+        "TERRAFORM_CI_TEMPLATE_DIR": os.path.join(ROOT, "templates"),
+        "TERRAFORM_CI_TIMINGS": timings,
+        "STUB_RESOURCES": str(args.resources),
+        "STUB_CHECKS": str(args.checks),
+        "STUB_FAILED": str(args.failed),
+        "STUB_LATENCY": str(args.latency),
+        "STUB_RATE_LIMIT": str(args.rate_limit),
+        "GITHUB_API_URL": api_url,
+        "GITHUB_REPOSITORY": "stub/terraform-ci",
+        "GITHUB_REPOSITORY_OWNER": "stub",
+        "GITHUB_REF_NAME": "0.0.0",
+        "GITHUB_RUN_ID": "1",
+    }
+
+    start = time.perf_counter()
+    with open(log_file, "w") as log:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "terraform_ci"],
+            cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        # wait4 gives the rusage of this run alone, its max RSS is that of the largest single
+        # process, the entry point or one of its stubs, not a sum over the tree
+        _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    if not os.path.exists(timings):
+        raise RuntimeError(f"{mode} run crashed, see {log_file}")
+
+    with open(timings) as f:
+        steps = json.load(f)
+    with open(log_file) as f:
+        retries = sum("Rate limited" in line for line in f)
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "mode": mode,
+        "exit_code": proc.returncode,
+        "wall": wall,
+        # kilobytes on linux
+        "peak_rss_kb": usage.ru_maxrss,
+        "retries": retries,
+        "steps": {"startup": wall - sum(steps.values()), **steps},
+    }
+
+
+def print_result(result: dict) -> None:
+    print(f"{result['mode']}: {result['wall']:.2f}s wall, exit {result['exit_code']}, "
+          f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MiB, {result['retries']} rate limit retries")
+    for step, seconds in result["steps"].items():
+        print(f"  {step:<10} {seconds:8.3f}s")
+
+
+def compare(results: list[dict], baseline_file: str, tolerance: float) -> bool:
+    """Checks wall time and peak RSS of each mode against a previous `--output` file."""
+    with open(baseline_file) as f:
+        baseline = {x["mode"]: x for x in json.load(f)["results"]}
+
+    ok = True
+    for result in results:
+        if result["mode"] not in baseline:
+            continue
+        for metric in ("wall", "peak_rss_kb"):
+            limit = baseline[result["mode"]][metric] * (1 + tolerance)
+            if result[metric] > limit:
+                print(f"::error title=E2E Regression::{result['mode']} {metric} {result[metric]:.2f} exceeds {limit:.2f}")
+                ok = False
+    return ok
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline end to end performance harness for terraform-ci.")
+    parser.add_argument("--modes", nargs="+", default=["plan", "apply"], choices=["plan", "apply", "drift"])
+    parser.add_argument("--resources", type=int, default=1000, help="Resources in the stub plan.")
+    parser.add_argument("--checks", type=int, default=10000, help="Passed checkov checks.")
+    parser.add_argument("--failed", type=int, default=10, help="Failed checkov checks.")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds each stub command takes.")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Plans failing on rate limits before succeeding.")
+    parser.add_argument("--parallelism", default="", help="Passed as the terraform_parallelism input.")
+    parser.add_argument("--output", help="Write the results as json.")
+    parser.add_argument("--baseline", help="Fail if slower or larger than this `--output` file.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline.")
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ReleasesHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    try:
+        results = [run_mode(mode, args, api_url) for mode in args.modes]
+    finally:
+        server.shutdown()
+
+    for result in results:
+        print_result(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+    if args.baseline and not compare(results, args.baseline, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,7 +7,7 @@ RETURN_CODE=$?
 while IFS= read -r line
 do
     echo "$line" >> $GITHUB_STEP_SUMMARY
-done < /app/template_result.md
+done < "${TERRAFORM_CI_TEMP_DIR:-/app}/template_result.md"
 
 echo "::debug::Python component return code is ${RETURN_CODE}"
 
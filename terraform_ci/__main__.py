@@ -1,10 +1,15 @@
 import os
+import sys
 
 from .terraform import TfCLI
 from .pipeline import ActionPipeline
-from .config import Settings
+from .config import Settings, get_env
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["worker"]:
+        from .worker import main
+        sys.exit(main(sys.argv[2:]))
+
     settings = Settings().config
 
     if settings.working_directory:
@@ -13,23 +18,8 @@ if __name__ == "__main__":
     TfCLI.set_version(version=settings.terraform.version)
     TfCLI.set_token(host=settings.terraform.host, token=settings.terraform.token)
 
-    if settings.mode == "plan":
-        (
-            ActionPipeline(settings)
-            .format()
-            .init()
-            .imports()
-            .plan()
-            .scan()
-            .report()
-            .cleanup()
-        )
-    else:
-        (
-            ActionPipeline(settings)
-            .init()
-            .plan()
-            .apply()
-            .report()
-            .cleanup()
-        )
+    ActionPipeline(
+        settings,
+        temp_dir=get_env("TERRAFORM_CI_TEMP_DIR"),
+        template_dir=get_env("TERRAFORM_CI_TEMPLATE_DIR"),
+    ).run()
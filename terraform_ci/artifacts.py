@@ -0,0 +1,48 @@
+import os
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class ArtifactStore:
+    """Caches parsed pipeline artifacts (json plan, checkov results, apply log) so each file is
+    read and parsed once no matter how many steps consume it. Entries are keyed by path and
+    loader. Steps call `invalidate` before rewriting an artifact, and entries are also reloaded
+    when the file's mtime or size changes underneath the store.
+
+    Loaders should return only the fields their consumers need, so large parts of the raw
+    artifact (like checkov's passed checks) are dropped as soon as it is parsed.
+    """
+
+    def __init__(self) -> None:
+        self._cache: dict[tuple[str, Callable], tuple[tuple[int, int], Any]] = {}
+
+    def get(self, path: str, loader: Callable[[str], T]) -> T | None:
+        """Returns the parsed artifact, loading it if missing from the cache or stale.
+
+        Args:
+            path (str): Path of the artifact.
+            loader (Callable[[str], T]): Parses the file at path.
+
+        Returns:
+            T | None: The parsed artifact, or None if the file does not exist.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._cache.pop((path, loader), None)
+            return None
+
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cache.get((path, loader))
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        value = loader(path)
+        self._cache[(path, loader)] = (stamp, value)
+        return value
+
+    def invalidate(self, path: str) -> None:
+        """Drops every cached entry for the path."""
+        for key in [key for key in self._cache if key[0] == path]:
+            del self._cache[key]
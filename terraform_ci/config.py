@@ -56,6 +56,8 @@ class TerraformConfig(BaseSchema):
     host: GithubStr | None = Field("app.terraform.io")
     token: GithubStr | None
     init_mode: Literal["migrate"] | Literal["reconfigure"] | Literal["upgrade"] | None
+    parallelism: int | Literal["auto"] | None
+    provider_parallelism: dict[str, int] = Field({})
 
     @validator("init_mode", pre=True)
     def v_init_mode(cls, value: str | None):
@@ -66,6 +68,32 @@ class TerraformConfig(BaseSchema):
             sys.exit(1)
         return value
 
+    @validator("parallelism", pre=True)
+    def v_parallelism(cls, value: Any | None):
+        if value is None or (isinstance(value, str) and value.strip() == ""):
+            return None
+        if isinstance(value, str) and value.strip() == "auto":
+            return "auto"
+        if int(value) < 1:
+            raise ValueError("Terraform parallelism must be a positive integer or 'auto'.")
+        return int(value)
+
+    @validator("provider_parallelism", pre=True)
+    def v_provider_parallelism(cls, hints: Any | None):
+        if hints:
+            if isinstance(hints, str):
+                parsed = {}
+                for itm in hints.split(","):
+                    name, sep, value = itm.partition("=")
+                    if not (sep and name.strip() and value.strip().isdigit()):
+                        raise ValueError(
+                            f"Provider parallelism '{itm.strip()}' must be formatted as '<provider>=<number>'."
+                        )
+                    parsed[name.strip()] = int(value)
+                return parsed
+            return hints
+        return {}
+
 
 class GithubConfig(BaseSchema):
     token: GithubStr | None
@@ -104,20 +132,46 @@ class ResourceConfig(BaseSchema):
         return []
 
 
+class DriftConfig(BaseSchema):
+    roots: list[str] = Field([])
+    concurrency: int = Field(4)
+    # Falls back to terraform.parallelism when unset
+    parallelism: int | Literal["auto"] | None = Field(None)
+
+    @validator("roots",  pre=True)
+    def v_roots(cls, roots: Any | None):
+        if roots:
+            if isinstance(roots, str):
+                return [itm.strip() for itm in roots.split(",") if itm.strip()]
+            return [itm.strip() for itm in roots if itm.strip()]
+        return []
+
+    @validator("concurrency", "parallelism", pre=True)
+    def v_positive(cls, value: Any | None, field):
+        if value is None or (isinstance(value, str) and value.strip() == ""):
+            return field.default
+        if field.name == "parallelism" and value == "auto":
+            return value
+        if int(value) < 1:
+            raise ValueError(f"Drift {field.name} must be a positive integer.")
+        return value
+
+
 class ActionSettings(BaseSchema):
-    mode: Literal["plan"] | Literal["apply"] = Field("plan")
+    mode: Literal["plan"] | Literal["apply"] | Literal["drift"] = Field("plan")
     working_directory: GithubStr | None = Field(".")
     create_release: bool | GithubStr | None = Field(False)
     terraform: TerraformConfig
     github: GithubConfig
     resource: ResourceConfig
+    drift: DriftConfig = Field(default_factory=DriftConfig)
 
     @validator("mode", pre=True)
     def v_mode(cls, value):
         if value is None or value.strip() == "":
             return "plan"
-        if value not in ["plan", "apply"]:
-            raise ValueError("Terraform run mode only supports 'plan' or 'apply'.")
+        if value not in ["plan", "apply", "drift"]:
+            raise ValueError("Terraform run mode only supports 'plan', 'apply' or 'drift'.")
         return value
 
 
@@ -1,41 +1,46 @@
+from typing import Iterable
 import pandas as pd
 import json
+import re
 
+from .plan import PlanIndex, ACTIONS
 
-def parse_tf_json(file: str) -> str:
-    """This function reads the json output of the terraform plan and looks for actions that are
-    either 'create', 'delete' or 'update'. Read actions labelled as 'no-op' are ignored.
+
+def parse_tf_json(index: PlanIndex) -> str:
+    """Formats the changed resources of the terraform plan. Actions labelled as 'no-op' or
+    'read' are ignored. A delete and create on the same resource is labelled 'replace'.
 
     If there are multiple actions like 'create' and 'update' on a complex item such as module
-    or resource with lots of blocks, we apply the label 'mix'.
+    or resource with lots of blocks, we apply the label 'mixed'.
+
+    Rows are ordered with deletes first, then replaces, updates, creates and mixed.
 
     Args:
-        file (str): full path to the json terraform plan output.
+        index (PlanIndex): Index of the json terraform plan output.
 
     Returns:
         str: A markdown formatted table of columns ['address', 'action']
     """
-    with open(file) as f:
-        data = json.load(f)
-
-    # we don't care about reads
-    only_ops = [x for x in data.get("resource_changes", []) if x.get("change", {}).get("actions", []) != ["no-op"]]
-    actions = {'create', 'delete', 'update'}
+    records = [{"address": x.address, "action": x.action} for x in index.ordered()]
+    if len(records) == 0:
+        records = {
+            "address": [],
+            "action": []
+        }
+    return pd.DataFrame(records).to_markdown(index=False)
 
-    # single action
-    report = {}
-    for action in actions:
-        report[action] = [x['address'] for x in only_ops if x.get("change", {}).get("actions", []) == [action]]
 
-    # partial changes (like adding another statement to a policy)
-    report['mixed'] = [x['address'] for x in only_ops if len(x.get("change", {}).get("actions", [])) > 1]
+def parse_tf_plan_modules(index: PlanIndex) -> str:
+    """Formats per module action counts of the terraform plan, modules with the most
+    deletes and replaces first.
 
-    records = []
-    for k, v in report.items():
-        for r in v:
-            records.append({"address": r, "action": k})
+    Args:
+        index (PlanIndex): Index of the json terraform plan output.
 
-    return pd.DataFrame(records).to_markdown(index=False)
+    Returns:
+        str: A markdown formatted table of columns ['module', *ACTIONS]
+    """
+    return pd.DataFrame(index.module_counts(), columns=["module", *ACTIONS]).to_markdown(index=False)
 
 
 def parse_tf_log(file: str) -> str:
@@ -46,39 +51,113 @@ def parse_tf_log(file: str) -> str:
     return raw
 
 
-def parse_tf_checkov(file: str) -> str:
-    """This functions reads the json output of the checkov run and selects only the needed
-    info from the result. Formats markdown with check_id links if existing.
+# Provider errors signalling the API is throttling us, only searched within error diagnostics.
+# Whole words only, so resource names and attributes don't match. Matches, for example:
+#   AWS:   "api error ThrottlingException: Rate exceeded"
+#   AWS:   "api error TooManyRequestsException: Too Many Requests"
+#   AWS:   "RequestLimitExceeded: Request limit exceeded."
+#   GCP:   "googleapi: Error 429: Quota exceeded for quota metric 'Queries', rateLimitExceeded"
+#   Azure: "StatusCode=429 -- Original Error: Code=\"TooManyRequests\""
+# but not:
+#   "with aws_api_gateway_stage.throttle,"
+#   "throttling_burst_limit = 10"
+RATE_LIMIT_PATTERN = re.compile(
+    r"\b(throttl(ed|ing)(exception)?|rate exceeded|rate ?limit(ed|exceeded)?"
+    r"|too ?many ?requests(exception)?|request ?limit ?exceeded|429)\b",
+    flags=re.IGNORECASE,
+)
+
+# Lines inside a diagnostic pointing at configuration (`with aws_x.y,`, `on main.tf line 3`)
+# or quoting it (`  3: resource ...`), which can contain arbitrary resource names.
+_DIAGNOSTIC_CONTEXT = re.compile(r"^(with |on |\d+:)")
+
+
+def is_rate_limited(log: str) -> bool:
+    """Checks the error diagnostics of the terraform plan log for provider rate limit errors.
+    Refresh output and the configuration context of each diagnostic are ignored.
+
+    Args:
+        log (str): The terraform plan log, as returned by `parse_tf_log`.
+
+    Returns:
+        bool: True if an error diagnostic looks like a rate limit error.
+    """
+    in_error = False
+    for line in log.splitlines():
+        if line.startswith("╵"):
+            in_error = False
+            continue
+
+        text = line.lstrip("│╷ \t")
+        if text.startswith("Error:"):
+            in_error = True
+        elif text.startswith("Warning:"):
+            in_error = False
+
+        if in_error and not _DIAGNOSTIC_CONTEXT.match(text) and RATE_LIMIT_PATTERN.search(text):
+            return True
+
+    return False
+
+
+def load_tf_checkov(file: str) -> dict:
+    """This functions reads the json output of the checkov run and keeps only what the pipeline
+    uses: the total of failed checks and the failed checks themselves. Passed checks, which
+    make up most of the file, are dropped right after parsing.
 
     Args:
         file (str): full path to the json checkov scan output.
 
     Returns:
-        str: A markdown formatted table of columns ['resource_address', 'check_id']
+        dict: With keys 'failed' (int) and 'failed_checks' (list of dicts with keys
+            ['check_id', 'guideline', 'resource_address']).
     """
 
     with open(file) as f:
         data = json.load(f)
 
+    # sometimes we get a single object
     if not isinstance(data, list):
         data = [data]
 
-    # only look in the results for failed checks
+    return {
+        "failed": sum(int(x.get('summary', {'failed': 0})['failed']) for x in data),
+        "failed_checks": [
+            {
+                "check_id": x['check_id'],
+                "guideline": x.get('guideline'),
+                "resource_address": x.get('resource_address'),
+            }
+            for check in data
+            for x in check.get('results', {}).get('failed_checks', [])
+        ],
+    }
+
+
+def parse_tf_checkov(result: dict) -> str:
+    """Formats the failed checks of the checkov run as markdown with check_id links if existing.
+
+    Args:
+        result (dict): Checkov result, as returned by `load_tf_checkov`.
+
+    Returns:
+        str: A markdown formatted table of columns ['resource_address', 'check_id']
+    """
+
     records = []
-    for check in data:
-        for x in check.get('results', {}).get('failed_checks', []):
-            rec = {}
-            # Guideline url in its own column is pointless
-            # Make the check number a link to the guideline url
-            if x.get('guideline'):
-                rec['check_id'] = f"[{x['check_id']}]({x.get('guideline')})"
-            else:
-                rec['check_id'] = x['check_id']
-
-            # we want the full address to find it in relation to top level modules
-            rec['resource_address'] = x.get('resource_address')
-
-            records.append(rec)
+    for x in result['failed_checks']:
+        rec = {}
+        # Guideline url in its own column is pointless
+        # Make the check number a link to the guideline url
+        if x.get('guideline'):
+            rec['check_id'] = f"[{x['check_id']}]({x.get('guideline')})"
+        else:
+            rec['check_id'] = x['check_id']
+
+        # we want the full address to find it in relation to top level modules
+        rec['resource_address'] = x.get('resource_address')
+
+        records.append(rec)
     if len(records) == 0:
         records = {
             "resource_address": [],
@@ -87,66 +166,115 @@ def parse_tf_checkov(file: str) -> str:
     return pd.DataFrame(records).to_markdown(index=False)
 
 
-def _read_apply_log(file: str) -> pd.DataFrame:
-    """Parses the terraform apply log. The log is in jsonlines format,
-    so we use pandas DataFrame to read it for us.
+def load_tf_apply(file: str) -> list[dict]:
+    """Parses the terraform apply log. The log is in jsonlines format, but sometimes
+    terraform likes to output stdout statements not in json format, those lines are skipped.
+    Only the message, type and hook address of each line are kept.
 
     Args:
         file (str): file path to terraform apply output.
 
     Returns:
-        pd.DataFrame: Dataframe of each apply action.
+        list[dict]: Records with keys ['message', 'type', 'address'] for each apply action.
     """
-    try:
-        # first attempt. Sometimes terraform likes to output stdout statements not in json format
-        return pd.read_json(file, lines=True)
-    except ValueError:
-        # fallback method: Read line by line and ignore bad formatted json.
-        lines = []
-        with open(file) as f:
-            for line in f.readlines():
-                try:
-                    lines.append(json.loads(line))
-                except json.JSONDecodeError:
-                    pass
-        return pd.DataFrame(lines)
-
-
-def parse_tf_apply(file: str) -> str:
-    """This parases the terraform apply output and constructs a
-    markdown formatted table out of the results. We filter for the 'hook' key
-    in the output as address.
+    records = []
+    with open(file) as f:
+        for line in f:
+            try:
+                x = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(x, dict):
+                continue
+
+            # If the message doesn't have a hook the address is None
+            hook = x.get("hook")
+            records.append({
+                "message": x.get("@message"),
+                "type": x.get("type"),
+                "address": hook.get("resource", {}).get("addr") if isinstance(hook, dict) else None,
+            })
+    return records
+
+
+def parse_tf_apply(records: list[dict]) -> str:
+    """This constructs a markdown formatted table out of the terraform apply
+    results. We filter for lines with a 'hook' address.
 
     Args:
-        file (str): file path to terraform apply output.
+        records (list[dict]): Apply records, as returned by `load_tf_apply`.
 
     Returns:
-        str: A markdown formatted table of columns ['address', 'message', 'type']
+        str: A markdown formatted table of columns ['message', 'type', 'address']
     """
 
-    data = _read_apply_log(file)
-
-    # If the message doesn't have a hook, it comes across here as a np.nan
-    # so we just filter any non-dict types out
-    if 'hook' in data.columns:
-        data['hook'] = data['hook'].apply(lambda x: x if isinstance(x, dict) else {})
-    else:
-        # If missing hook (as in nothing was done), we just populate empty dicts
-        # so the next logic step returns None
-        data['hook'] = [{}] * len(data)
-
     ignores = ['apply_start', 'apply_progress', 'apply_errored']
 
-    df = pd.DataFrame([{"message": x["@message"], "type": x['type'],
-                      'address': x.get("hook", {}).get("resource", {}).get("addr")} for x in data.to_dict('records')])
+    df = pd.DataFrame(records, columns=["message", "type", "address"])
 
     return df.loc[(df['address'].notna()) & (~df['type'].isin(ignores))].to_markdown(index=False)
 
 
-def parse_tf_apply_summary(file: str) -> str:
-    """Parses the terraform apply json output and returns the raw output."""
-    data = _read_apply_log(file).to_dict('records')
+def parse_tf_apply_summary(records: list[dict]) -> str:
+    """Returns the messages of the terraform apply json output."""
+    return '\n'.join(x["message"] for x in records if x["message"] is not None)
 
-    summary = [x["@message"] for x in data]
 
-    return '\n'.join(summary)
+def read_tf_drift(lines: Iterable[str]) -> tuple[list[dict], list[str], bool]:
+    """Reads the streamed jsonlines output of `terraform plan -refresh-only -json` and keeps
+    only the 'resource_drift' events and error diagnostics. Everything else (refresh progress,
+    version banners, non json lines) is dropped as it arrives, so memory stays flat no matter
+    how large the root is.
+
+    Args:
+        lines (Iterable[str]): Lines of terraform json output.
+
+    Returns:
+        tuple[list[dict], list[str], bool]: Drifted resources as `{address, action}`, error
+            summaries and whether any error was a provider rate limit.
+    """
+    drifted = []
+    errors = []
+    rate_limited = False
+    for line in lines:
+        # cheap pre-filter, most events are refresh progress
+        if '"resource_drift"' not in line and '"diagnostic"' not in line:
+            continue
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+
+        match event.get("type"):
+            case "resource_drift":
+                change = event.get("change", {})
+                drifted.append({
+                    "address": change.get("resource", {}).get("addr"),
+                    "action": change.get("action"),
+                })
+            case "diagnostic" if event.get("@level") == "error":
+                diagnostic = event.get("diagnostic", {})
+                errors.append(diagnostic.get("summary") or event.get("@message"))
+                text = f"{diagnostic.get('summary', '')} {diagnostic.get('detail', '')}"
+                rate_limited = rate_limited or RATE_LIMIT_PATTERN.search(text) is not None
+
+    return drifted, errors, rate_limited
+
+
+def parse_tf_drift(records: list[dict]) -> str:
+    """Formats drift records from all roots into a single markdown table.
+
+    Args:
+        records (list[dict]): Records with keys ['root', 'address', 'action'].
+
+    Returns:
+        str: A markdown formatted table of columns ['root', 'address', 'action']
+    """
+    records = sorted(records, key=lambda x: (x['root'], x['address'] or ""))
+    if len(records) == 0:
+        records = {
+            "root": [],
+            "address": [],
+            "action": []
+        }
+    return pd.DataFrame(records, columns=["root", "address", "action"]).to_markdown(index=False)
@@ -1,16 +1,33 @@
 import os
 import sys
 import json
+import time
 import jinja2
 import requests
+import threading
+from contextlib import nullcontext
+from functools import lru_cache
 from subprocess import Popen
-
-from .parser import parse_tf_json, parse_tf_log, parse_tf_checkov, parse_tf_apply, parse_tf_apply_summary
-from .terraform import TfCLI
+from concurrent.futures import ThreadPoolExecutor
+
+from .parser import (
+    parse_tf_json, parse_tf_plan_modules, parse_tf_log, parse_tf_checkov, parse_tf_apply, parse_tf_apply_summary,
+    read_tf_drift, parse_tf_drift, is_rate_limited, load_tf_checkov, load_tf_apply,
+)
+from .artifacts import ArtifactStore
+from .plan import PlanIndex
+from .terraform import TfCLI, resolve_parallelism, DEFAULT_PARALLELISM
 from .config import get_env, ActionSettings
 from . import __issues__, __version__
 
 
+@lru_cache
+def load_template(path: str) -> jinja2.Template:
+    """Reads and compiles a jinja template once per process."""
+    with open(path) as f:
+        return jinja2.Environment().from_string(f.read())
+
+
 def icon(flag: bool) -> str:
     if flag:
         return "✅"
@@ -24,13 +41,57 @@ class ActionPipeline:
     plan_result = False
     scan_result = False
     apply_result = False
+    drift_result = False
     # Flag this false on a bad import
     import_result = True
-
-    def __init__(self, settings: ActionSettings, hard_fail=False, temp_dir: str | None = None) -> None:
+    drift_records: list[dict] = []
+    # Parallelism used by plan, reused by apply
+    parallelism: int | None = None
+
+    PLAN_RETRIES = 2
+
+    # Terraform's provider plugin cache isn't safe for concurrent inits
+    _init_lock = threading.Lock()
+
+    # Steps run for each mode, in order
+    STEPS = {
+        "plan": ("format", "init", "imports", "plan", "scan", "report", "cleanup"),
+        "apply": ("init", "plan", "apply", "report", "cleanup"),
+        "drift": ("drift", "report", "cleanup"),
+    }
+
+    def __init__(
+        self,
+        settings: ActionSettings,
+        hard_fail=False,
+        temp_dir: str | None = None,
+        template_dir: str | None = None,
+    ) -> None:
         self.hard_fail = hard_fail
-        self.temp_dir = "/app"
+        self.temp_dir = temp_dir or "/app"
+        self._template_dir = template_dir
         self.settings = settings
+        self.artifacts = ArtifactStore()
+
+    @property
+    def plan_index(self) -> PlanIndex | None:
+        """Index of the json plan. None if there is no json plan."""
+        return self.artifacts.get(self.json_plan, PlanIndex.from_file)
+
+    @property
+    def checkov_result(self) -> dict | None:
+        """Failed checkov checks. None if checkov wrote no results."""
+        return self.artifacts.get(self.checkov, load_tf_checkov)
+
+    @property
+    def plan_log(self) -> str | None:
+        """Terraform plan log. None if there is no log."""
+        return self.artifacts.get(self.log_plan, parse_tf_log)
+
+    @property
+    def apply_records(self) -> list[dict] | None:
+        """Terraform apply log records. None if apply emitted no json."""
+        return self.artifacts.get(self.apply_json, load_tf_apply)
 
     @property
     def template_result(self):
@@ -54,7 +115,7 @@ class ActionPipeline:
     @property
     def template_dir(self):
         """Directory of templates"""
-        return os.path.join(self.temp_dir, "templates")
+        return self._template_dir or os.path.join(self.temp_dir, "templates")
 
     @property
     def apply_json(self):
@@ -66,6 +127,29 @@ class ActionPipeline:
         """Checkov json result file"""
         return os.path.join(self.temp_dir, "results_json.json")
 
+    def run(self) -> "ActionPipeline":
+        """Runs every step for the configured mode. Exits through `cleanup`.
+
+        If `TERRAFORM_CI_TIMINGS` is set, the seconds spent in each step are written
+        there as json on the way out.
+
+        Returns:
+            ActionPipeline: Self for chaining.
+        """
+        timings = {}
+        try:
+            for step in self.STEPS[self.settings.mode]:
+                start = time.perf_counter()
+                try:
+                    getattr(self, step)()
+                finally:
+                    timings[step] = time.perf_counter() - start
+        finally:
+            if timings_file := get_env("TERRAFORM_CI_TIMINGS"):
+                with open(timings_file, "w") as f:
+                    json.dump(timings, f)
+        return self
+
     def format(self) -> "ActionPipeline":
         """Runs terraform format.
 
@@ -109,6 +193,19 @@ class ActionPipeline:
         """Runs the terraform init check with optional terraform mode.
 
         """
+        with TfCLI(*self._init_args()) as cli:
+            ret_code = cli()
+            self.init_result = ret_code == 0
+            print(f"::debug::Terraform init check result is {self.init_result} with return code {ret_code}")
+
+        if self.hard_fail and not self.init_result:
+            print("::error title=Terraform Init::Failed terraform init.")
+            sys.exit(1)
+
+        return self
+
+    def _init_args(self) -> list[str]:
+        """Terraform init arguments for the configured init mode."""
         init_args = ["init"]
 
         match self.settings.terraform.init_mode:
@@ -124,35 +221,48 @@ class ActionPipeline:
                 print("::error title=Terraform Init::Unsupported arguement.")
                 sys.exit(1)
 
-        with TfCLI(*init_args) as cli:
-            ret_code = cli()
-            self.init_result = ret_code == 0
-            print(f"::debug::Terraform init check result is {self.init_result} with return code {ret_code}")
-
-        if self.hard_fail and not self.init_result:
-            print("::error title=Terraform Init::Failed terraform init.")
-            sys.exit(1)
-
-        return self
+        return init_args
 
     def plan(self) -> "ActionPipeline":
         """Runs terraform plan, logging out to std out as well as log file.
 
+        If the plan fails on provider rate limit errors, it is retried with half
+        the parallelism, up to `PLAN_RETRIES` times.
 
         Returns:
             ActionPipeline: Self for chaining.
         """
-        tf_args = ["plan", "-input=false", "-no-color", "-out", self.bin_plan]
+        self.parallelism = resolve_parallelism(
+            self.settings.terraform.parallelism, self.settings.terraform.provider_parallelism
+        )
 
-        for resource in self.settings.resource.replace:
-            tf_args += [f'-replace="{resource}"']
+        for attempt in range(self.PLAN_RETRIES + 1):
+            tf_args = ["plan", "-input=false", "-no-color", "-out", self.bin_plan]
 
-        tf_args += ["2>&1 | tee", self.log_plan]
+            if self.parallelism is not None:
+                tf_args += [f"-parallelism={self.parallelism}"]
 
-        with TfCLI(*tf_args, with_shell=True, pipefail=True) as cli:
-            ret_code = cli()
-            self.plan_result = ret_code in [0, 2]
-            print(f"::debug::Terraform plan check result is {self.plan_result} with return code {ret_code}")
+            for resource in self.settings.resource.replace:
+                tf_args += [f'-replace="{resource}"']
+
+            tf_args += ["2>&1 | tee", self.log_plan]
+
+            self.artifacts.invalidate(self.log_plan)
+            with TfCLI(*tf_args, with_shell=True, pipefail=True) as cli:
+                ret_code = cli()
+                self.plan_result = ret_code in [0, 2]
+                print(f"::debug::Terraform plan check result is {self.plan_result} with return code {ret_code}")
+
+            if self.plan_result or attempt == self.PLAN_RETRIES:
+                break
+            if not (self.plan_log is not None and is_rate_limited(self.plan_log)):
+                break
+
+            current = self.parallelism or DEFAULT_PARALLELISM
+            if current <= 1:
+                break
+            self.parallelism = current // 2
+            print(f"::warning title=Terraform Plan::Rate limited, retrying with parallelism {self.parallelism}.")
 
         if self.hard_fail and not self.plan_result:
             print("::error title=Terraform Plan::Failed terraform plan.")
@@ -167,6 +277,7 @@ class ActionPipeline:
         if not (self.plan_result and os.path.exists(self.bin_plan)):
             print("::error title=Terraform Plan::Failed to convert terraform plan.")
             return False
+        self.artifacts.invalidate(self.json_plan)
         with TfCLI("show", "-json", "-no-color", self.bin_plan, stdout=True) as cli:
             with open(self.json_plan, "w") as f:
                 if cli() == 0:
@@ -183,6 +294,7 @@ class ActionPipeline:
         if not (self.plan_result and os.path.exists(self.json_plan)):
             return self
 
+        self.artifacts.invalidate(self.checkov)
         proc = Popen(
             ["checkov", "--output-file-path", self.temp_dir, "-o", "json", "-f", self.json_plan],
             shell=False,
@@ -191,15 +303,10 @@ class ActionPipeline:
         ret_code = int(proc.returncode)
         scan_result = (ret_code == 0)
 
-        with open(self.checkov) as f:
-            result: dict | list[dict] = json.load(f)
-
-        # sometimes we get a single object
-        if not isinstance(result, list):
-            result: list[dict] = [result]
+        result = self.checkov_result
 
         # ensure checkov ran and no failures were found
-        self.scan_result = scan_result and sum(int(x.get('summary', {'failed': 0})['failed']) for x in result) == 0
+        self.scan_result = scan_result and result is not None and result['failed'] == 0
         print(f"::debug::Checkov scan check result is {self.scan_result} with return code {ret_code}")
 
         return self
@@ -209,9 +316,16 @@ class ActionPipeline:
             print(f"::debug::Terraform apply check result could not find plan.")
             return self
 
-        tf_args = [
-            "apply", "-auto-approve", "-no-color", "-json", self.bin_plan, "2>&1 | tee", self.apply_json
-        ]
+        # A saved plan can't be retried after a partial apply, so rate limits aren't retried here.
+        # Reuse the parallelism plan settled on instead.
+        tf_args = ["apply", "-auto-approve", "-no-color", "-json"]
+
+        if self.parallelism is not None:
+            tf_args += [f"-parallelism={self.parallelism}"]
+
+        tf_args += [self.bin_plan, "2>&1 | tee", self.apply_json]
+
+        self.artifacts.invalidate(self.apply_json)
 
         with TfCLI(*tf_args, with_shell=True, pipefail=True) as cli:
             ret_code = cli()
@@ -220,23 +334,126 @@ class ActionPipeline:
 
         return self
 
+    def drift(self) -> "ActionPipeline":
+        """Runs a refresh-only plan on every configured root concurrently and collects the
+        drifted resources. Format and checkov are skipped as a refresh-only plan never
+        proposes configuration changes. Each root is inited before its plan so roots
+        can be scheduled straight from a fresh checkout. Like `plan`, a root failing on
+        provider rate limits is retried with half the parallelism.
+
+        Returns:
+            ActionPipeline: Self for chaining.
+        """
+        roots = self.settings.drift.roots or ["."]
+
+        with ThreadPoolExecutor(max_workers=self.settings.drift.concurrency) as pool:
+            results = list(pool.map(self._drift_root, roots))
+
+        self.drift_records = [record for records, _, _ in results for record in records]
+        self.init_result = all(init_ok for _, init_ok, _ in results)
+        # a root that failed init never ran its plan
+        self.plan_result = all(init_ok and plan_ok for _, init_ok, plan_ok in results)
+        self.drift_result = self.plan_result and not self.drift_records
+        print(f"::debug::Terraform drift check result is {self.drift_result} with {len(self.drift_records)} drifted resources")
+
+        if self.hard_fail and not self.plan_result:
+            print("::error title=Terraform Drift::Failed terraform drift check.")
+            sys.exit(1)
+
+        return self
+
+    def _drift_root(self, root: str) -> tuple[list[dict], bool, bool]:
+        """Inits and runs the refresh-only plan for a single root, streaming the json events.
+        A root that can't be run at all (e.g. a missing directory) is reported as a failed
+        init rather than failing every other root.
+
+        Args:
+            root (str): Path of the terraform root, relative to the working directory.
+
+        Returns:
+            tuple[list[dict], bool, bool]: Drift records for the root, whether init succeeded
+                and whether the refresh-only plan succeeded.
+        """
+        try:
+            return self._refresh_root(root)
+        except OSError as e:
+            print(f"::error title=Terraform Drift::Could not run terraform in {root}: {e}.")
+            return [{"root": root, "address": e.strerror or str(e), "action": "error"}], False, False
+
+    def _refresh_root(self, root: str) -> tuple[list[dict], bool, bool]:
+        """Body of `_drift_root`."""
+        with self._init_lock if os.environ.get("TF_PLUGIN_CACHE_DIR") else nullcontext():
+            with TfCLI(*self._init_args(), "-input=false", "-no-color", cwd=root) as cli:
+                ret_code = cli()
+
+        if ret_code != 0:
+            print(f"::error title=Terraform Drift::Failed terraform init in {root}.")
+            return [{"root": root, "address": "terraform init", "action": "error"}], False, False
+
+        parallelism = resolve_parallelism(
+            self.settings.drift.parallelism or self.settings.terraform.parallelism,
+            self.settings.terraform.provider_parallelism,
+            lock_file=os.path.join(root, ".terraform.lock.hcl"),
+        )
+
+        for attempt in range(self.PLAN_RETRIES + 1):
+            tf_args = ["plan", "-refresh-only", "-json", "-input=false", "-no-color", "-lock=false"]
+
+            if parallelism is not None:
+                tf_args += [f"-parallelism={parallelism}"]
+
+            with TfCLI(*tf_args, stdout=True, cwd=root) as cli:
+                drifted, errors, rate_limited = read_tf_drift(cli.lines())
+                ret_code = cli()
+                print(f"::debug::Terraform drift in {root} found {len(drifted)} resources with return code {ret_code}")
+
+            if ret_code == 0 or attempt == self.PLAN_RETRIES or not rate_limited:
+                break
+
+            current = parallelism or DEFAULT_PARALLELISM
+            if current <= 1:
+                break
+            parallelism = current // 2
+            print(f"::warning title=Terraform Drift::Rate limited in {root}, retrying with parallelism {parallelism}.")
+
+        records = [{"root": root, **x} for x in drifted]
+        if ret_code != 0:
+            records += [{"root": root, "address": x, "action": "error"} for x in errors or ["terraform plan"]]
+            return records, True, False
+
+        return records, True, True
+
     def report(self) -> "ActionPipeline":
+        if self.settings.mode == "drift":
+            template = self._drift_template().render(
+                init_check=icon(self.init_result),
+                drift_check=icon(self.drift_result),
+                drift_txt=parse_tf_drift(self.drift_records),
+                version=__version__,
+                tracker=__issues__,
+            )
+            with open(self.template_result, "w") as f:
+                f.write(template)
+            return self
+
         plan_markdown = "Error reading plan."
-        if os.path.exists(self.json_plan):
-            plan_markdown = parse_tf_json(self.json_plan)
+        modules_markdown = "Error reading plan."
+        if self.plan_index is not None:
+            plan_markdown = parse_tf_json(self.plan_index)
+            modules_markdown = parse_tf_plan_modules(self.plan_index)
         else:
             print(f"::warning title=Terraform Plan::Error reading plan.")
 
         log_plan = "Error reading log."
-        if os.path.exists(self.log_plan):
-            log_plan = parse_tf_log(self.log_plan)
+        if self.plan_log is not None:
+            log_plan = self.plan_log
         else:
             print(f"::warning title=Terraform Plan::Error reading summary.")
 
         if self.settings.mode == "plan":
             checkov_result = "Error loading checkov results."
-            if os.path.exists(self.checkov):
-                checkov_result = parse_tf_checkov(self.checkov)
+            if self.checkov_result is not None:
+                checkov_result = parse_tf_checkov(self.checkov_result)
             else:
                 print(f"::warning title=Terraform Plan::Error reading summary.")
 
@@ -246,6 +463,7 @@ class ActionPipeline:
                 plan_check=icon(self.plan_result),
                 scan_check=icon(self.scan_result),
                 plan_txt=plan_markdown,
+                modules_txt=modules_markdown,
                 summary_txt=log_plan,
                 checkov_txt=checkov_result,
                 version=__version__,
@@ -255,9 +473,9 @@ class ActionPipeline:
             apply_check = "Error loading apply."
             apply_summary = "Error loading summary apply."
             # as long as json was emitted.
-            if os.path.exists(self.apply_json):
-                apply_check = parse_tf_apply(self.apply_json)
-                apply_summary = parse_tf_apply_summary(self.apply_json)
+            if self.apply_records is not None:
+                apply_check = parse_tf_apply(self.apply_records)
+                apply_summary = parse_tf_apply_summary(self.apply_records)
 
             template = self._apply_template().render(
                 plan_txt=plan_markdown,
@@ -291,6 +509,15 @@ class ActionPipeline:
                 print(f"::debug::Exiting plan mode successfully with code 0")
                 sys.exit(0)
 
+        elif self.settings.mode == "drift":
+            if all([
+                self.init_result,
+                self.plan_result,
+                self.drift_result
+            ]):
+                print(f"::debug::Exiting drift successfully with code 0")
+                sys.exit(0)
+
         else:
             if all([
                 self.init_result,
@@ -304,12 +531,13 @@ class ActionPipeline:
         sys.exit(1)
 
     def _plan_template(self):
-        with open(os.path.join(self.template_dir, "Plan.md")) as f:
-            return jinja2.Environment().from_string(f.read())
+        return load_template(os.path.join(self.template_dir, "Plan.md"))
 
     def _apply_template(self):
-        with open(os.path.join(self.template_dir, "Apply.md")) as f:
-            return jinja2.Environment().from_string(f.read())
+        return load_template(os.path.join(self.template_dir, "Apply.md"))
+
+    def _drift_template(self):
+        return load_template(os.path.join(self.template_dir, "Drift.md"))
 
     def post_apply_output(self, summary: str) -> bool:
         """Takes in the summary string formatted in markdown and 
@@ -328,13 +556,15 @@ class ActionPipeline:
         GITHUB_REF_NAME = os.environ["GITHUB_REF_NAME"]
         GITHUB_TOKEN = self.settings.github.token
         GITHUB_RUN_ID = os.environ["GITHUB_RUN_ID"]
+        # Set by github actions, differs on GitHub Enterprise Server
+        GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
 
         if len(summary) >= 125000:
             os.environ["GITHUB_STEP_SUMMARY"] = os.environ.get("GITHUB_STEP_SUMMARY", "") + summary
             summary = f"Release text too large, see plan summary from job at https://github.com/{GITHUB_REPOSITORY_NAME}/actions/runs/{GITHUB_RUN_ID}"
 
         response = requests.post(
-            f"https://api.github.com/repos/{GITHUB_REPOSITORY}/releases",
+            f"{GITHUB_API_URL}/repos/{GITHUB_REPOSITORY}/releases",
             headers={
                 "Authorization": f"token {GITHUB_TOKEN}",
                 "Accept": "application/vnd.github+json"
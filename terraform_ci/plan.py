@@ -0,0 +1,114 @@
+import json
+import sys
+
+
+# Report order, most destructive first
+ACTIONS = ("delete", "replace", "update", "create", "mixed")
+
+ROOT_MODULE = "root"
+
+
+def plan_action(actions: list[str]) -> str | None:
+    """Collapses the terraform `change.actions` list into a single label. Reads and
+    no-ops are ignored. A delete and create pair in either order is a replace, any
+    other combination is labelled 'mixed'.
+
+    Args:
+        actions (list[str]): Actions from a `resource_changes` entry.
+
+    Returns:
+        str | None: One of `ACTIONS`, or None when there is nothing to report.
+    """
+    match actions:
+        case ["create"] | ["delete"] | ["update"]:
+            return actions[0]
+        case ["delete", "create"] | ["create", "delete"]:
+            return "replace"
+        case [] | ["no-op"] | ["read"]:
+            return None
+        case _:
+            return "mixed"
+
+
+class PlanResource:
+    """A single changed resource in the plan."""
+    __slots__ = ("address", "module", "type", "action")
+
+    def __init__(self, address: str, module: str, type: str, action: str) -> None:
+        self.address = address
+        self.module = module
+        self.type = type
+        self.action = action
+
+
+class PlanIndex:
+    """Compact index over the `resource_changes` of a terraform json plan. Built once in a
+    single pass, after which lookups by module, action and resource type never touch the
+    json again. Module paths, resource types and actions are interned so the many repeats
+    across a large plan share a single string.
+    """
+
+    def __init__(self, resources: list[PlanResource]) -> None:
+        self.resources = resources
+        self.by_module: dict[str, list[PlanResource]] = {}
+        self.by_action: dict[str, list[PlanResource]] = {action: [] for action in ACTIONS}
+        self.by_type: dict[str, list[PlanResource]] = {}
+
+        for resource in resources:
+            self.by_module.setdefault(resource.module, []).append(resource)
+            self.by_action[resource.action].append(resource)
+            self.by_type.setdefault(resource.type, []).append(resource)
+
+    @classmethod
+    def from_file(cls, file: str) -> "PlanIndex":
+        """Builds the index from the json terraform plan output.
+
+        Args:
+            file (str): full path to the json terraform plan output.
+
+        Returns:
+            PlanIndex: Index of all changed resources.
+        """
+        with open(file) as f:
+            data = json.load(f)
+
+        return cls.from_changes(data.get("resource_changes", []))
+
+    @classmethod
+    def from_changes(cls, changes: list[dict]) -> "PlanIndex":
+        """Builds the index from the `resource_changes` of a json terraform plan."""
+        resources = []
+        for change in changes:
+            action = plan_action(change.get("change", {}).get("actions", []))
+            if action is None:
+                continue
+            resources.append(PlanResource(
+                address=change["address"],
+                module=sys.intern(change.get("module_address") or ROOT_MODULE),
+                type=sys.intern(change.get("type") or ""),
+                action=action,
+            ))
+        return cls(resources)
+
+    def ordered(self) -> list[PlanResource]:
+        """All resources grouped by action, most destructive first, then by address."""
+        return [
+            resource
+            for action in ACTIONS
+            for resource in sorted(self.by_action[action], key=lambda x: x.address)
+        ]
+
+    def module_counts(self) -> list[dict]:
+        """Action counts per module, modules with the most deletes and replaces first.
+
+        Returns:
+            list[dict]: Records with keys 'module' and one per action in `ACTIONS`.
+        """
+        records = []
+        for module, resources in self.by_module.items():
+            record = {"module": module, **{action: 0 for action in ACTIONS}}
+            for resource in resources:
+                record[resource.action] += 1
+            records.append(record)
+
+        return sorted(records, key=lambda x: (-x["delete"], -x["replace"], x["module"]))
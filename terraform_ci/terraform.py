@@ -1,5 +1,7 @@
 from subprocess import Popen, PIPE
+from typing import Iterator, Literal
 import os
+import re
 
 from .config import get_env
 
@@ -11,15 +13,66 @@ credentials "{h}" {{
 """
 
 
+# Terraform's own default when -parallelism is not passed
+DEFAULT_PARALLELISM = 10
+
+
+def _lock_providers(lock_file: str) -> list[str]:
+    """Lists provider sources (e.g. `registry.terraform.io/hashicorp/aws`) pinned in the
+    dependency lock file written by `terraform init`."""
+    if not os.path.exists(lock_file):
+        return []
+    with open(lock_file) as f:
+        return re.findall(r'^provider\s+"([^"]+)"', f.read(), flags=re.MULTILINE)
+
+
+def resolve_parallelism(
+    parallelism: int | Literal["auto"] | None,
+    provider_parallelism: dict[str, int] | None = None,
+    lock_file: str = ".terraform.lock.hcl",
+) -> int | None:
+    """Works out the value for terraform's `-parallelism` flag.
+
+    Refreshing and applying is bound by provider API round trips rather than local CPU,
+    so 'auto' runs four operations per CPU, between terraform's default and 64. Per provider
+    hints cap the result for any provider pinned in the lock file, matched either by full
+    source or by name (`aws`), to stay under API rate limits.
+
+    Args:
+        parallelism (int | Literal["auto"] | None): Configured parallelism.
+        provider_parallelism (dict[str, int] | None): Max parallelism per provider.
+        lock_file (str): Path to the dependency lock file of the root.
+
+    Returns:
+        int | None: The parallelism to pass, or None to leave terraform's default.
+    """
+    if parallelism == "auto":
+        parallelism = min(max(DEFAULT_PARALLELISM, (os.cpu_count() or 1) * 4), 64)
+
+    hints = []
+    if provider_parallelism:
+        for provider in _lock_providers(lock_file):
+            hints += [
+                hint for name, hint in provider_parallelism.items()
+                if name in (provider, provider.split("/")[-1])
+            ]
+
+    if hints:
+        return min([parallelism or DEFAULT_PARALLELISM, *hints])
+
+    return parallelism
+
+
 class TfCLI:
     stdout = None
 
-    def __init__(self, *args, with_shell=False, stdout=False, pipefail=False):
+    def __init__(self, *args, with_shell=False, stdout=False, pipefail=False, cwd: str | None = None):
         """Wrapper for terraform cli"""
         self.proc_args = list(args)
         self.proc: Popen[bytes] | None = None
         self.with_shell = with_shell
         self.pipefail = pipefail
+        self.cwd = cwd
         if stdout:
             self.stdout_mode = PIPE
         else:
@@ -31,7 +84,7 @@ class TfCLI:
         command = self._command()
         print(f"::debug::Terraform command is `{command}`")
         self.proc = Popen(self._command(), shell=self.with_shell, stdout=self.stdout_mode,
-                          executable="/bin/bash" if self.with_shell else None)
+                          executable="/bin/bash" if self.with_shell else None, cwd=self.cwd)
 
         return self
 
@@ -67,6 +120,14 @@ class TfCLI:
             return int(self.proc.returncode)
         return 1
 
+    def lines(self) -> Iterator[str]:
+        """Streams stdout line by line as terraform emits it, rather than buffering the
+        whole output like `__call__` does. Requires `stdout=True`. Call the instance
+        afterwards to collect the return code."""
+        if self.proc and self.proc.stdout:
+            for line in self.proc.stdout:
+                yield line.decode()
+
     @staticmethod
     def set_version(version: str | None = None) -> int:
         """Sets the terraform version in the environment.
@@ -82,12 +143,16 @@ class TfCLI:
         return int(proc.returncode)
 
     @staticmethod
-    def set_token(host: str | None = "app.terraform.io", token: str | None = None) -> int:
+    def set_token(host: str | None = "app.terraform.io", token: str | None = None, path: str | None = None) -> int:
+        """Writes the terraform cli config with credentials for the host. Defaults to
+        `~/.terraformrc`, pass `path` (and point `TF_CLI_CONFIG_FILE` at it) to keep
+        credentials scoped to a single job.
+        """
 
         if token is None:
             return 0
 
-        with open(os.path.join(os.path.expanduser('~'), ".terraformrc"), "w") as f:
+        with open(path or os.path.join(os.path.expanduser('~'), ".terraformrc"), "w") as f:
             f.write(_token_tpl(host or "app.terraform.io", token))
 
         print("Created .terraformrc file.")
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import socket
+import shutil
+import tempfile
+import argparse
+import traceback
+import yaml
+
+from .terraform import TfCLI
+from .pipeline import ActionPipeline
+from .config import ActionSettings
+
+
+JOB_SUFFIXES = (".json", ".yaml", ".yml")
+
+
+class Worker:
+    """Long running service for self hosted runners. Jobs are `ActionSettings` payloads dropped
+    into a spool directory and are processed one at a time by the same interpreter, so python
+    imports, compiled templates, the terraform binary and the provider plugin cache stay warm
+    between jobs. Start several workers on the same spool directory to process jobs in parallel,
+    jobs are claimed with an atomic rename into `running/<name>/`. Each worker needs a distinct
+    `name`, it also keys the worker's provider plugin cache, as terraform's cache isn't safe for
+    concurrent writers.
+
+    A job file holds the action config under `config` and optional per job environment
+    variables (cloud credentials, `GITHUB_*`) under `env`:
+
+        config:
+          mode: plan
+          workingDirectory: /builds/infra/envs/staging
+          terraform:
+            token: "..."
+        env:
+          AWS_PROFILE: staging
+
+    Each job gets its own temp directory for plan artifacts and its terraform cli config,
+    and sees only its own `env` on top of the worker environment. The worker user's
+    `~/.terraformrc` is never used for jobs, credentials come from the job's `terraform.token`. The job file itself is
+    deleted once the job ends, only `result.json` and `template_result.md` are kept in
+    `done/<job>/`. Jobs left in `running/<name>/` by a crashed worker are reported as failed
+    when a worker with the same name starts again.
+    """
+
+    def __init__(
+        self,
+        spool_dir: str,
+        name: str | None = None,
+        template_dir: str = "/app/templates",
+        plugin_cache_dir: str | None = None,
+        poll_interval: float = 1.0,
+    ) -> None:
+        self.name = name or socket.gethostname()
+        # jobs chdir into their working directory, so keep every path absolute
+        self.spool_dir = os.path.abspath(spool_dir)
+        self.template_dir = os.path.abspath(template_dir)
+        self.poll_interval = poll_interval
+        self.plugin_cache_dir = os.path.abspath(
+            plugin_cache_dir or os.path.join(spool_dir, "plugin-cache", self.name)
+        )
+        # Version last installed by tfswitch, None until the first job
+        self._tf_version: str | None = None
+
+        for path in (self.running_dir, self.done_dir, self.plugin_cache_dir):
+            os.makedirs(path, exist_ok=True)
+
+        # Shared by every job of this worker so providers are only downloaded once
+        os.environ.setdefault("TF_PLUGIN_CACHE_DIR", self.plugin_cache_dir)
+
+        self.recover()
+
+    @property
+    def running_dir(self):
+        """Jobs claimed by this worker"""
+        return os.path.join(self.spool_dir, "running", self.name)
+
+    @property
+    def done_dir(self):
+        """Job results"""
+        return os.path.join(self.spool_dir, "done")
+
+    def recover(self) -> int:
+        """Fails jobs this worker claimed but never finished, e.g. because it crashed. They are
+        not re-run, as an apply may have partially gone through.
+
+        Returns:
+            int: Number of jobs recovered.
+        """
+        recovered = 0
+        for entry in os.scandir(self.running_dir):
+            if entry.is_file():
+                print(f"::warning title=Worker::Job {entry.name} was interrupted, marking it failed.")
+                self._finish(entry.path, 1, 0.0, error="Job was interrupted by a worker restart.")
+                recovered += 1
+        return recovered
+
+    def serve(self) -> None:
+        """Processes jobs until interrupted."""
+        print(f"::debug::Worker polling {self.spool_dir}")
+        while True:
+            if not self.poll():
+                time.sleep(self.poll_interval)
+
+    def poll(self) -> int:
+        """Processes every job currently in the spool directory, oldest first.
+
+        Returns:
+            int: Number of jobs processed.
+        """
+        jobs = []
+        for entry in os.scandir(self.spool_dir):
+            if not (entry.is_file() and entry.name.endswith(JOB_SUFFIXES)):
+                continue
+            try:
+                jobs.append((entry.stat().st_mtime, entry.path, entry.name))
+            except FileNotFoundError:
+                # claimed by another worker since the scan
+                continue
+
+        processed = 0
+        for _, path, name in sorted(jobs):
+            claimed = os.path.join(self.running_dir, name)
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # another worker got there first
+                continue
+            self.process(claimed)
+            processed += 1
+
+        return processed
+
+    def process(self, job_file: str) -> int:
+        """Runs a single claimed job and stores its results.
+
+        Args:
+            job_file (str): Path to the claimed job file.
+
+        Returns:
+            int: Exit code of the pipeline.
+        """
+        name = os.path.splitext(os.path.basename(job_file))[0]
+        result_dir = os.path.join(self.done_dir, name)
+        os.makedirs(result_dir, exist_ok=True)
+
+        job_dir = tempfile.mkdtemp(prefix=f"terraform-ci-{name}-")
+        error = None
+        start = time.monotonic()
+        try:
+            with open(job_file) as f:
+                payload = yaml.safe_load(f) or {}
+            ret_code = self._run(payload, job_dir)
+        except Exception as e:
+            traceback.print_exc()
+            ret_code = 1
+            error = str(e)
+        finally:
+            template_result = os.path.join(job_dir, "template_result.md")
+            if os.path.exists(template_result):
+                shutil.copy(template_result, result_dir)
+            # job dir holds the terraform credentials, never leave it behind
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+        self._finish(job_file, ret_code, time.monotonic() - start, error=error)
+        return ret_code
+
+    def _finish(self, job_file: str, ret_code: int, duration: float, error: str | None = None) -> None:
+        """Writes `result.json` and deletes the job file, which holds the job's tokens and env."""
+        name = os.path.splitext(os.path.basename(job_file))[0]
+        result_dir = os.path.join(self.done_dir, name)
+        os.makedirs(result_dir, exist_ok=True)
+
+        with open(os.path.join(result_dir, "result.json"), "w") as f:
+            json.dump({"return_code": ret_code, "duration": duration, "error": error}, f)
+        os.remove(job_file)
+
+        print(f"::debug::Worker finished job {name} with code {ret_code}")
+
+    def _run(self, payload: dict, job_dir: str) -> int:
+        """Runs the pipeline for a job payload with the job's environment and working directory,
+        restoring the worker's afterwards."""
+        settings = ActionSettings.parse_obj(payload.get("config", {}))
+
+        environ = os.environ.copy()
+        cwd = os.getcwd()
+        try:
+            os.environ.update({k: str(v) for k, v in payload.get("env", {}).items()})
+            # Always point terraform at a config file of the job's own, an empty one when there
+            # is no token, so it neither complains about a missing file nor falls back to the
+            # worker user's ~/.terraformrc
+            cli_config = os.path.join(job_dir, ".terraformrc")
+            open(cli_config, "w").close()
+            os.environ["TF_CLI_CONFIG_FILE"] = cli_config
+
+            if settings.working_directory:
+                os.chdir(settings.working_directory)
+
+            self._set_version(settings.terraform.version)
+            TfCLI.set_token(
+                host=settings.terraform.host,
+                token=settings.terraform.token,
+                path=cli_config,
+            )
+
+            try:
+                ActionPipeline(settings, temp_dir=job_dir, template_dir=self.template_dir).run()
+            except SystemExit as e:
+                return int(e.code or 0)
+            return 0
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def _set_version(self, version: str | None) -> None:
+        """Only calls tfswitch when the job asks for a different version than the last one."""
+        version = version or "latest"
+        if version != self._tf_version and TfCLI.set_version(version=version) == 0:
+            self._tf_version = version
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m terraform_ci worker",
+        description="Processes spooled terraform-ci jobs with a warm interpreter and caches.",
+    )
+    parser.add_argument("spool_dir", help="Directory to pick up job files from.")
+    parser.add_argument("--name", default=None,
+                        help="Unique name of this worker on the spool, defaults to the hostname.")
+    parser.add_argument("--template-dir", default="/app/templates", help="Directory of report templates.")
+    parser.add_argument("--plugin-cache-dir", default=None,
+                        help="Provider plugin cache, must not be shared with other workers.")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the spool is empty.")
+    parser.add_argument("--once", action="store_true", help="Process the jobs currently spooled and exit.")
+    args = parser.parse_args(argv)
+
+    worker = Worker(
+        args.spool_dir,
+        name=args.name,
+        template_dir=args.template_dir,
+        plugin_cache_dir=args.plugin_cache_dir,
+        poll_interval=args.poll_interval,
+    )
+
+    if args.once:
+        worker.poll()
+        return 0
+
+    try:
+        worker.serve()
+    except KeyboardInterrupt:
+        pass
+    return 0